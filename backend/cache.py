@@ -0,0 +1,63 @@
+# cache.py
+from collections import OrderedDict
+import os, time
+import orjson
+
+REDIS_URL = os.getenv("REDIS_URL", "").strip()
+DEFAULT_TTL = 7 * 24 * 3600
+
+
+class LLMCache:
+    """In-process LRU cache for LLM responses with per-entry TTL."""
+
+    def __init__(self, maxsize: int = 512):
+        self.maxsize = maxsize
+        self._data: OrderedDict[str, tuple[float, object]] = OrderedDict()
+
+    async def get(self, key: str):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            self._data.pop(key, None)
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value, ttl: int = DEFAULT_TTL):
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
+class RedisLLMCache:
+    """Redis-backed cache shared across uvicorn workers; values stored as JSON."""
+
+    def __init__(self, url: str):
+        import redis.asyncio as aioredis
+        self._redis = aioredis.from_url(url)
+
+    async def get(self, key: str):
+        try:
+            raw = await self._redis.get(key)
+        except Exception:
+            return None
+        return orjson.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, value, ttl: int = DEFAULT_TTL):
+        try:
+            await self._redis.set(key, orjson.dumps(value), ex=ttl)
+        except Exception:
+            pass
+
+
+def make_cache():
+    # Prefer Redis when configured and installed; else fall back to in-process cache
+    if REDIS_URL:
+        try:
+            return RedisLLMCache(REDIS_URL)
+        except Exception:
+            pass
+    return LLMCache()
@@ -1,77 +1,214 @@
 from fireworks import LLM
 from dotenv import load_dotenv
-import os, base64, json, re
+import os, io, base64, asyncio, hashlib, logging
+import orjson
+from textwrap import dedent
+from cache import make_cache, DEFAULT_TTL
+from PIL import Image, ImageOps
+try:
+    import pybase64 as _b64  # SIMD-accelerated, drop-in for base64
+except ImportError:
+    _b64 = base64
+
+# Every app logger sits under "kyc" so main.py can apply LOG_LEVEL in one place
+logger = logging.getLogger(f"kyc.{__name__}")
+
+class LLMOutputError(ValueError):
+    """The model's reply could not be parsed as the requested JSON object."""
 
 load_dotenv()
 api_key = os.getenv("FIREWORKS_API_KEY")
 if not api_key:
     raise ValueError("FIREWORKS_API_KEY not set in environment")
 
+# Connection pooling is the SDK's own: size its keep-alive pool for the concurrency cap below.
+# LLM forwards both options to the underlying FireworksClient.
+_LLM_POOL_KWARGS = {"max_connections": 128, "request_timeout": 60}
+
+def _shrink(file_bytes: bytes, mime: str, max_dim: int = 1600, quality: int = 85) -> tuple[bytes, str]:
+    # The vision model gains nothing past ~1600px; downscale large photos and re-encode as JPEG
+    if not mime.startswith("image/"):
+        return file_bytes, mime
+    try:
+        img = Image.open(io.BytesIO(file_bytes))
+        if max(img.size) <= max_dim:
+            return file_bytes, mime
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        img.thumbnail((max_dim, max_dim))
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=quality, optimize=True)
+        return buf.getvalue(), "image/jpeg"
+    except Exception:
+        return file_bytes, mime
+
+def _data_url(file_bytes: bytes, mime: str) -> str:
+    file_bytes, mime = _shrink(file_bytes, mime)
+    # One C-level encode (SIMD with pybase64); the SDK needs the URL as a str, so it decodes once
+    return f"data:{mime};base64," + _b64.b64encode(file_bytes).decode("ascii")
+
+# Bump when prompt wording changes so cached responses are not reused across versions
+PROMPT_VERSION = "v3"
+
+# Prompts are static, dedented once at import, and lead with text shared across doc types so
+# the server's prefix (KV) cache can be reused; per-request content (the image) goes last.
+_DOC_LABELS = {"passport": "passport", "drivers_license": "driver's license"}
+_DOC_FIELDS = {
+    "passport": "name, dob (YYYY-MM-DD), issuing_country (ISO3), id_number, expiry_date (YYYY-MM-DD)",
+    "drivers_license": "name, dob (YYYY-MM-DD), issuing_state (USPS), id_number, expiry_date (YYYY-MM-DD), address",
+}
+
+_EXTRACT_TEMPLATE = dedent("""
+    Return only a valid JSON object. If a field is missing, set it to null.
+    Extract the following fields from this {label}.
+    Keys: {fields}.""").strip()
+
+# Fused verify + extract prompt: one image upload answers type, integrity and fields.
+# It never names the expected document, so the TYPE answer stays independent of the caller's
+# doc_type; the expected-vs-inferred comparison happens afterwards (verify.type_result).
+_PROCESS_TEMPLATE = dedent("""
+    You are a cautious identity verification assistant.
+    Complete all three sections below for the document in the image.
+
+    TYPE:
+    - Decide what kind of document this is: "passport", "drivers_license" or "unknown".
+
+    INTEGRITY:
+    - Assess whether the document appears authentic or suspicious.
+    - Look for validity: MRZ lines on a passport, a PDF417 barcode on a driver's license, consistent fonts, correct placement of fields.
+    - Look for tampering: mismatched fonts, cut-and-paste artifacts, blurred text, misaligned photo, missing hologram/barcode/MRZ.
+    - If uncertain, set "is_suspected_fraud": false with low confidence and explain.
+    - Do not hallucinate security features that are not visible.
+
+    Return ONLY a valid JSON object with this schema:
+    {{
+    "inferred_type": "passport" | "drivers_license" | "unknown",
+    "is_suspected_fraud": true | false,
+    "confidence": 0.0-1.0,
+    "explanation": "short rationale",
+    "extracted": {{ ...FIELDS keys... }}
+    }}
+
+    FIELDS:
+    - Extract these keys: {fields}.
+    - If a field is missing, set it to null.""").strip()
+
+PROMPTS = {
+    "ocr": "Transcribe all legible text exactly as seen (no summaries).",
+    **{
+        doc_type: _EXTRACT_TEMPLATE.format(label=label, fields=_DOC_FIELDS[doc_type])
+        for doc_type, label in _DOC_LABELS.items()
+    },
+    **{
+        f"process:{doc_type}": _PROCESS_TEMPLATE.format(fields=_DOC_FIELDS[doc_type])
+        for doc_type in _DOC_LABELS
+    },
+}
+
 class FireworksLLM:
-    def __init__(self):
+    def __init__(self, max_concurrent_requests: int = 32):
+        # Caps in-flight Fireworks calls so concurrent endpoints don't trip rate limits
+        self._sem = asyncio.Semaphore(max_concurrent_requests)
+        self.cache = make_cache()
         self.llm = LLM(model="llama4-maverick-instruct-basic",
                        deployment_type="auto",
-                       api_key=api_key)
+                       api_key=api_key,
+                       **_LLM_POOL_KWARGS)
         self.ocr = LLM(model = "accounts/fireworks/models/firesearch-ocr-v6",
                        id="accounts/priya1605/deployments/ik5cfzil",
                        deployment_type="on-demand",
-                       api_key=api_key)
-
-    def extract_passport(self, file_bytes: bytes, mime: str):
-        prompt = """Extract the following fields from this Passport.
-                Return only JSON with keys: name, dob (YYYY-MM-DD), issuing_country (ISO3),
-                id_number, expiry_date (YYYY-MM-DD).
-                If a field is missing, set it to null.
-                Ensure the output is only a valid JSON object."""
-        
-        return self.extract_bytes(prompt, file_bytes, mime)
+                       api_key=api_key,
+                       **_LLM_POOL_KWARGS)
+
+    async def extract_passport(self, file_bytes: bytes, mime: str):
+        return await self.extract_bytes(PROMPTS["passport"], file_bytes, mime)
     
-    def extract_drivers_license(self, file_bytes: bytes, mime: str):
-        prompt = """Extract the following fields from this ID document.
-                Return only JSON with keys: name, dob (YYYY-MM-DD), issuing_state (USPS),
-                id_number, expiry_date (YYYY-MM-DD), address.
-                If a field is missing, set it to null.
-                Ensure the output is only a valid JSON object."""
-        
-        return self.extract_bytes(prompt, file_bytes, mime)
+    async def extract_drivers_license(self, file_bytes: bytes, mime: str):
+        return await self.extract_bytes(PROMPTS["drivers_license"], file_bytes, mime)
+
+    async def verify_and_extract(self, file_bytes: bytes, mime: str, doc_type: str):
+        """Single multimodal call returning inferred type, integrity verdict and extracted fields."""
+        prompt = PROMPTS.get(f"process:{doc_type}", PROMPTS["process:drivers_license"])
+        result = await self.extract_bytes(prompt, file_bytes, mime)
+        if not isinstance(result, dict):
+            result = {}
+        extracted = result.get("extracted")
+        return {
+            "inferred_type": str(result.get("inferred_type") or "unknown").lower(),
+            "is_suspected_fraud": result.get("is_suspected_fraud"),
+            "confidence": result.get("confidence"),
+            "explanation": result.get("explanation"),
+            "extracted": extracted if isinstance(extracted, dict) else {},
+        }
+
+    @staticmethod
+    def _cache_key(kind: str, prompt: str, file_bytes: bytes, mime: str) -> str:
+        h = hashlib.sha256(PROMPT_VERSION.encode() + prompt.encode() + mime.encode())
+        h.update(file_bytes)
+        return f"{kind}:{h.hexdigest()}"
+
+    async def _achat(self, client, messages, **kwargs):
+        # Non-blocking completion; the semaphore bounds concurrent Fireworks calls
+        async with self._sem:
+            return await client.chat.completions.acreate(messages=messages, **kwargs)
     
-    def extract_bytes(self, prompt: str, file_bytes: bytes, mime: str):
-        b64 = base64.b64encode(file_bytes).decode("ascii")
-        data_url = f"data:{mime};base64,{b64}"
-        resp = self.llm.chat.completions.create(
-            messages=[{
-                "role": "user",
-                "content": [
-                    {"type": "image_url", "image_url": {"url": data_url}},
-                    {"type": "text", "text": prompt},
-                ],
-            }]
-        )
+    async def extract_bytes(self, prompt: str, file_bytes: bytes, mime: str, data_url: str | None = None):
+        key = self._cache_key("extract", prompt, file_bytes, mime)
+        cached = await self.cache.get(key)
+        if cached is not None:
+            return cached
+        data_url = data_url or await asyncio.to_thread(_data_url, file_bytes, mime)
+        resp = await self._achat(self.llm, [{
+            "role": "user",
+            "content": [
+                {"type": "text", "text": prompt},
+                {"type": "image_url", "image_url": {"url": data_url}},
+            ],
+        }], response_format={"type": "json_object"})
+        # JSON mode returns a bare JSON object, so no fence stripping is needed
         text = resp.choices[0].message.content
+        logger.debug("LLM output: %s", text)
         try:
-            text = re.sub(r"^```[a-zA-Z]*\n|\n```$", "", text.strip(), flags=re.MULTILINE)
-            print(text)
-            return json.loads(text) if isinstance(text, str) else (text or {})
-        except Exception:
-            return {}
+            result = orjson.loads(text)
+        except (orjson.JSONDecodeError, TypeError):
+            # Empty content or output cut off at the token limit: surface it, don't cache it
+            logger.warning("unparseable LLM output (finish_reason=%s)", getattr(resp.choices[0], "finish_reason", None))
+            raise LLMOutputError("model returned invalid JSON") from None
+        await self.cache.set(key, result, ttl=DEFAULT_TTL)
+        return result
         
-    def extract_via_ocr(self, prompt: str, file_bytes: bytes, mime: str):
-        raw_text = self.ocr_text(file_bytes, mime)
+    async def extract_via_ocr(self, prompt: str, file_bytes: bytes, mime: str):
+        # Encode once and share the data URL between the OCR and parsing calls
+        data_url = await asyncio.to_thread(_data_url, file_bytes, mime)
+        # OCR and a vision-only extraction don't depend on each other; run them concurrently
+        raw_text, vision = await asyncio.gather(
+            self.ocr_text(file_bytes, mime, data_url=data_url),
+            self.extract_bytes(prompt, file_bytes, mime, data_url=data_url),
+        )
+        vision = vision if isinstance(vision, dict) else {}
+        if vision and all(v is not None for v in vision.values()):
+            return vision
+        # Vision pass left gaps: parse again grounded on the OCR text, keeping vision values as fallback
         parsing_prompt = (
             f"{prompt}\n\nOCR_TEXT:\n" + raw_text[:12000]
         )
-        return self.extract_bytes(parsing_prompt, file_bytes, mime)
+        parsed = await self.extract_bytes(parsing_prompt, file_bytes, mime, data_url=data_url)
+        if not isinstance(parsed, dict):
+            return vision
+        return {**vision, **{k: v for k, v in parsed.items() if v is not None}}
     
-    def ocr_text(self, file_bytes: bytes, mime: str):
-        b64 = base64.b64encode(file_bytes).decode("ascii")
-        data_url = f"data:{mime};base64,{b64}"
-        resp = self.ocr.chat.completions.create(
-            messages=[{
-                "role": "user",
-                "content": [
-                    {"type": "image_url", "image_url": {"url": data_url}},
-                    {"type": "text", "text": "Transcribe all legible text exactly as seen (no summaries)."},
-                ],
-            }]
-        )
-        return resp.choices[0].message.content or ""
\ No newline at end of file
+    async def ocr_text(self, file_bytes: bytes, mime: str, data_url: str | None = None):
+        key = self._cache_key("ocr", PROMPTS["ocr"], file_bytes, mime)
+        cached = await self.cache.get(key)
+        if cached is not None:
+            return cached
+        data_url = data_url or await asyncio.to_thread(_data_url, file_bytes, mime)
+        resp = await self._achat(self.ocr, [{
+            "role": "user",
+            "content": [
+                {"type": "text", "text": PROMPTS["ocr"]},
+                {"type": "image_url", "image_url": {"url": data_url}},
+            ],
+        }])
+        text = resp.choices[0].message.content or ""
+        await self.cache.set(key, text, ttl=DEFAULT_TTL)
+        return text
@@ -0,0 +1,16 @@
+# guardrails.py
+# Cheap pre-filters that answer the authenticity verdict for obvious non-documents
+
+MIN_DOCUMENT_BYTES = 5_000
+_MAGIC_PREFIXES = (b"\xff\xd8\xff", b"\x89PN", b"%PD")  # JPEG, PNG, PDF
+
+
+def precheck_document(file_bytes: bytes):
+    """Return a canned integrity verdict for garbage uploads, or None if the file should go to the model."""
+    if len(file_bytes) < MIN_DOCUMENT_BYTES:
+        explanation = "image too small"
+    elif not file_bytes.startswith(_MAGIC_PREFIXES):
+        explanation = "file is not a JPEG, PNG or PDF"
+    else:
+        return None
+    return {"is_suspected_fraud": True, "confidence": 0.95, "explanation": explanation}
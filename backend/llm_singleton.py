@@ -0,0 +1,5 @@
+# llm_singleton.py
+# One shared FireworksLLM (SDK clients, semaphore, response cache) for the whole process
+from extract import FireworksLLM
+
+fireworks_llm = FireworksLLM()
@@ -2,17 +2,45 @@
 import fastapi
 from fastapi import UploadFile, File, Form
 from pydantic import BaseModel
-from extract import FireworksLLM
+from llm_singleton import fireworks_llm
+from extract import LLMOutputError
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from validators import (
     validate_required_fields_passport,
     validate_required_fields_drivers_license,
     validate_consistency_passport_and_drivers_license,
 )
-from verify import verify_document_integrity, verify_document_type
+from verify import verify_document_integrity, verify_document_type, type_result, integrity_result
+from guardrails import precheck_document
 import json
+import asyncio
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
 
-app = fastapi.FastAPI()
+# Handlers only enqueue records; a background listener thread does the actual stdout I/O.
+# The root stays at WARNING so library chatter (httpx logs every request at INFO) is dropped;
+# LOG_LEVEL applies to this app's own loggers only.
+_log_queue = queue.SimpleQueue()
+logging.basicConfig(level=logging.WARNING, handlers=[logging.handlers.QueueHandler(_log_queue)])
+_log_level = logging.getLevelName(os.getenv("LOG_LEVEL", "INFO").strip().upper())
+if not isinstance(_log_level, int):
+    _log_level = logging.INFO
+# App modules log under the "kyc" parent (kyc.<module>), so one setLevel covers all of them
+APP_LOGGER = "kyc"
+logging.getLogger(APP_LOGGER).setLevel(_log_level)
+_log_listener = logging.handlers.QueueListener(_log_queue, logging.StreamHandler())
+_log_listener.start()
+atexit.register(_log_listener.stop)
+logger = logging.getLogger(f"{APP_LOGGER}.{__name__}")
+
+# Documents of one /extract/bulk request processed at once (matches FireworksLLM's call cap)
+BULK_CONCURRENCY = 32
+
+app = fastapi.FastAPI(default_response_class=ORJSONResponse)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],   # or your frontend domain
@@ -21,7 +49,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-fireworks_llm = FireworksLLM()
+@app.exception_handler(LLMOutputError)
+async def _llm_output_error(request: fastapi.Request, exc: LLMOutputError):
+    # Bad model output is an upstream failure, not a server bug
+    return ORJSONResponse(status_code=502, content={"detail": str(exc)})
 
 @app.get("/health")
 def health():
@@ -32,29 +63,56 @@ async def verify_type(files: list[UploadFile] = File(...),
                       doc_type: str = Form(...)):
     uf = files[0]
     file_bytes = await uf.read()
-    result = verify_document_type(file_bytes, uf.content_type or "image/jpeg", doc_type)
+    result = await verify_document_type(file_bytes, uf.content_type or "image/jpeg", doc_type)
     return result if isinstance(result, dict) else {}
 
 @app.post("/verify")
 async def verify(files: list[UploadFile] = File(...), doc_type: str = Form(...)):
     uf = files[0]
     file_bytes = await uf.read()
-    result = verify_document_integrity(file_bytes, uf.content_type or "image/jpeg", doc_type)
-    print(result)
+    result = await verify_document_integrity(file_bytes, uf.content_type or "image/jpeg", doc_type)
+    logger.debug("verify result: %s", result)
     return result if isinstance(result, dict) else {}
 
+def _validate(doc_type: str, extracted: dict):
+    if doc_type == "passport":
+        return validate_required_fields_passport(extracted)
+    return validate_required_fields_drivers_license(extracted)
+
+@app.post("/process")
+async def process(files: list[UploadFile] = File(...),
+                  doc_type: str = Form(...),
+                  case_id: str = Form("")):
+    uf = files[0]
+    file_bytes = await uf.read()
+    processed = await fireworks_llm.verify_and_extract(file_bytes, uf.content_type or "image/jpeg", doc_type)
+    extracted = processed["extracted"]
+    validators = _validate(doc_type, extracted)
+
+    final_status = "pass" if all(v.get("status") == "pass" for v in validators) else "fail"
+
+    return {
+        "doc_id": case_id or "demo-doc",
+        "doc_type": doc_type,
+        "model": "llama4-maverick-instruct-basic",
+        "type": type_result(processed, doc_type),
+        # The pre-filter only overrides the authenticity verdict; type and fields still come from the model
+        "integrity": precheck_document(file_bytes) or integrity_result(processed, doc_type),
+        "extracted": extracted,
+        "validators": validators,
+        "score": 0,
+        "final_status": final_status,
+    }
+
 @app.post("/extract")
 async def extract(files: list[UploadFile] = File(...),
                   doc_type: str = Form(...),
                   case_id: str = Form("")):
     uf = files[0]
     file_bytes = await uf.read()
-    if doc_type == "passport":
-        extracted = fireworks_llm.extract_passport(file_bytes, uf.content_type or "image/jpeg")
-        validators = validate_required_fields_passport(extracted)
-    else:
-        extracted = fireworks_llm.extract_drivers_license(file_bytes, uf.content_type or "image/jpeg")
-        validators = validate_required_fields_drivers_license(extracted)
+    processed = await fireworks_llm.verify_and_extract(file_bytes, uf.content_type or "image/jpeg", doc_type)
+    extracted = processed["extracted"]
+    validators = _validate(doc_type, extracted)
 
     final_status = "pass" if all(v.get("status") == "pass" for v in validators) else "fail"
 
@@ -68,17 +126,55 @@ async def extract(files: list[UploadFile] = File(...),
         "final_status": final_status,
     }
 
+@app.post("/extract/bulk")
+async def extract_bulk(files: list[UploadFile] = File(...),
+                       doc_type: str = Form(...),
+                       case_id: str = Form("")):
+    # Online bulk path: documents go out concurrently, and each task reads its own upload only
+    # once it holds a slot, so at most BULK_CONCURRENCY files are in memory at a time
+    sem = asyncio.Semaphore(BULK_CONCURRENCY)
+
+    async def _one(i: int, uf: UploadFile):
+        async with sem:
+            file_bytes = await uf.read()
+            processed = await fireworks_llm.verify_and_extract(file_bytes, uf.content_type or "image/jpeg", doc_type)
+        validators = _validate(doc_type, processed["extracted"])
+        return {
+            "doc_id": f"{case_id or 'demo-doc'}-{i}",
+            "filename": uf.filename,
+            "extracted": processed["extracted"],
+            "validators": validators,
+            "final_status": "pass" if all(v.get("status") == "pass" for v in validators) else "fail",
+        }
+
+    # One failed document must not discard the rest of the batch
+    outcomes = await asyncio.gather(*(_one(i, uf) for i, uf in enumerate(files)), return_exceptions=True)
+
+    results = []
+    for i, (uf, out) in enumerate(zip(files, outcomes)):
+        if isinstance(out, BaseException):
+            logger.warning("bulk extract failed for %s: %s", uf.filename, out)
+            out = {"doc_id": f"{case_id or 'demo-doc'}-{i}", "filename": uf.filename, "error": str(out)}
+        results.append(out)
+
+    return {
+        "doc_type": doc_type,
+        "model": "llama4-maverick-instruct-basic",
+        "results": results,
+    }
+
 @app.post("/extract/both")
 async def extract_both(passport: UploadFile = File(...),
                        drivers_license: UploadFile = File(...),
                        case_id: str = Form("")):
     # Read files
-    p_bytes = await passport.read()
-    d_bytes = await drivers_license.read()
+    p_bytes, d_bytes = await asyncio.gather(passport.read(), drivers_license.read())
 
-    # Extract
-    p_extracted = fireworks_llm.extract_passport(p_bytes, passport.content_type or "image/jpeg")
-    d_extracted = fireworks_llm.extract_drivers_license(d_bytes, drivers_license.content_type or "image/jpeg")
+    # Extract (independent LLM calls, run concurrently)
+    p_extracted, d_extracted = await asyncio.gather(
+        fireworks_llm.extract_passport(p_bytes, passport.content_type or "image/jpeg"),
+        fireworks_llm.extract_drivers_license(d_bytes, drivers_license.content_type or "image/jpeg"),
+    )
 
     # Validate
     p_validators = validate_required_fields_passport(p_extracted)
@@ -1,20 +1,21 @@
 # validators.py
 from datetime import date, datetime
 import unicodedata
-import re
+import string
 import os
 import json
-from extract import FireworksLLM
+from llm_singleton import fireworks_llm
 
+# Maps every ASCII char except a-z and space to a space, in one C-level pass
+_KEEP = set(string.ascii_lowercase + " ")
+_NAME_TRANS = str.maketrans({c: " " for c in map(chr, range(128)) if c not in _KEEP})
 
 
 def _normalize_name(name: str | None) -> list[str]:
     if not name:
         return []
-    text = unicodedata.normalize("NFKD", name).lower()
-    text = re.sub(r"[^a-z\s]", " ", text)
-    tokens = [t for t in text.split() if t]
-    return tokens
+    text = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode("ascii")
+    return text.lower().translate(_NAME_TRANS).split()
 
 
 def _parse_date(s: str | None):
@@ -28,46 +29,45 @@ def _parse_date(s: str | None):
     return None
 
 
-def validate_required_fields_passport(d):
-    out = []
+def _fast_iso_date(s: str) -> date:
+    # Fixed YYYY-MM-DD layout; slicing avoids the cost of datetime.strptime
+    if len(s) != 10 or s[4] != "-" or s[7] != "-":
+        raise ValueError(f"not an ISO date: {s!r}")
+    return date(int(s[0:4]), int(s[5:7]), int(s[8:10]))
+
+
+PASSPORT_REQUIRED = ("name", "dob", "expiry_date", "id_number", "issuing_country")
+DL_REQUIRED = ("name", "dob", "expiry_date", "id_number", "issuing_state", "address")
+
+
+def _validate(d, required: tuple[str, ...]):
     # required fields
-    for k in ["name", "dob", "expiry_date", "id_number", "issuing_country"]:
-        out.append({"name": f"required:{k}", "status": "pass" if d.get(k) else "fail"})
+    out = [{"name": f"required:{k}", "status": "pass" if d.get(k) else "fail"} for k in required]
+    today = date.today()
+    today_iso = today.isoformat()
     # expiry
     try:
         out.append({"name": "expiry_future",
-                    "status": "pass" if d.get("expiry_date") and d["expiry_date"] >= date.today().isoformat() else "fail"})
+                    "status": "pass" if d.get("expiry_date") and d["expiry_date"] >= today_iso else "fail"})
     except Exception:
         out.append({"name": "expiry_future", "status": "warn"})
     # age check (>=18)
     try:
-        dob = datetime.strptime(d.get("dob", ""), "%Y-%m-%d").date()
-        age = (date.today() - dob).days // 365
+        dob = _fast_iso_date(d.get("dob", ""))
+        # Exact calendar age: subtract one if this year's birthday hasn't happened yet
+        age = today.year - dob.year - ((today.month, today.day) < (dob.month, dob.day))
         out.append({"name": "age_check", "status": "pass" if age >= 18 else "fail"})
     except Exception:
         out.append({"name": "age_check", "status": "warn"})
     return out
 
 
+def validate_required_fields_passport(d):
+    return _validate(d, PASSPORT_REQUIRED)
+
+
 def validate_required_fields_drivers_license(d):
-    out = []
-    # required fields
-    for k in ["name", "dob", "expiry_date", "id_number", "issuing_state", "address"]:
-        out.append({"name": f"required:{k}", "status": "pass" if d.get(k) else "fail"})
-    # expiry
-    try:
-        out.append({"name": "expiry_future",
-                    "status": "pass" if d.get("expiry_date") and d["expiry_date"] >= date.today().isoformat() else "fail"})
-    except Exception:
-        out.append({"name": "expiry_future", "status": "warn"})
-    # age check (>=18)
-    try:
-        dob = datetime.strptime(d.get("dob", ""), "%Y-%m-%d").date()
-        age = (date.today() - dob).days // 365
-        out.append({"name": "age_check", "status": "pass" if age >= 18 else "fail"})
-    except Exception:
-        out.append({"name": "age_check", "status": "warn"})
-    return out
+    return _validate(d, DL_REQUIRED)
 
 
 def validate_consistency_passport_and_drivers_license(passport: dict, drivers_license: dict):
@@ -94,7 +94,7 @@ def validate_consistency_passport_and_drivers_license(passport: dict, drivers_li
     # # LLM fallback only if rule-based failed for name and LLM is available
     # if not name_rule:
     #     try:
-    #         llm = FireworksLLM()
+    #         llm = fireworks_llm.llm
     #         prompt = (
     #             "You are verifying if two ID records refer to the same person based ONLY on name.\n"
     #             "Return ONLY JSON: {\"same_person\": true|false}.\n\n"
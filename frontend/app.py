@@ -2,23 +2,48 @@
 import io
 import os
 import json
+import atexit
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import streamlit as st
 from typing import List
-from datetime import datetime
+import time
 import random
 import base64
 import hashlib
-import pandas 
+try:
+    import orjson
+except ImportError:  # stdlib fallback
+    orjson = None
 
 # -----------------------
 # Config
 # -----------------------
 # Backend base URL (env override recommended for deployments)
 BACKEND_BASE = os.getenv("BACKEND_URL", "http://127.0.0.1:8000")
-EXTRACT_URL = f"{BACKEND_BASE}/extract"
 VERIFY_TYPE_URL = f"{BACKEND_BASE}/verify_type"
-VERIFY_URL = f"{BACKEND_BASE}/verify"
+PROCESS_URL = f"{BACKEND_BASE}/process"
+
+# Pooled keep-alive session, created once per process (the script body reruns on every interaction)
+@st.cache_resource
+def _http_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=8,
+        # Each backend POST is a full LLM call, so a POST is only retried when the connection never
+        # opened (connect retries apply to every method). Read timeouts are never retried, and
+        # 502/503/504 are retried for GETs only, so the backend's error detail reaches the caller.
+        max_retries=Retry(total=2, connect=2, read=0, backoff_factor=0.2, status_forcelist=[502, 503, 504],
+                          allowed_methods=frozenset({"GET"})),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+SESSION = _http_session()
 
 # Local "DB" directory
 DB_ROOT = os.getenv("LOCAL_DB_DIR", os.path.join(os.getcwd(), "local_db"))
@@ -37,12 +62,11 @@ ALLOWED_EXT = {"jpg", "jpeg", "png", "pdf"}
 # -----------------------
 # Helpers
 # -----------------------
-def bytes_to_mb(n: int) -> float:
-    return round(n / (1024 * 1024), 2)
+_ALLOWED_SUFFIXES = tuple("." + e for e in ALLOWED_EXT)
+_BYTES_PER_MB = 1.0 / (1024 * 1024)
 
 def is_allowed(filename: str) -> bool:
-    ext = filename.split(".")[-1].lower()
-    return ext in ALLOWED_EXT
+    return filename.lower().endswith(_ALLOWED_SUFFIXES)
 
 def validate_uploads(files: List[st.runtime.uploaded_file_manager.UploadedFile]) -> list[str]:
     errors = []
@@ -54,94 +78,184 @@ def validate_uploads(files: List[st.runtime.uploaded_file_manager.UploadedFile])
     for f in files:
         if not is_allowed(f.name):
             errors.append(f"Unsupported file type for {f.name}. Allowed: {', '.join(sorted(ALLOWED_EXT))}.")
-        size_mb = bytes_to_mb(f.size)
+        size_mb = f.size * _BYTES_PER_MB
         if size_mb > MAX_MB:
-            errors.append(f"{f.name} is too large ({size_mb} MB). Max is {MAX_MB} MB.")
+            errors.append(f"{f.name} is too large ({round(size_mb, 2)} MB). Max is {MAX_MB} MB.")
     return errors
 
 def mask_text(s: str | None) -> str:
     if not s:
         return ""
-    if len(s) <= 6:
-        return "•" * len(s)
-    return s[:2] + "•" * (len(s) - 6) + s[-4:]
+    n = len(s)
+    if n <= 6:
+        return "•" * n  # too short to reveal any characters
+    return f"{s[:2]}{'•' * (n - 6)}{s[-4:]}"
 
 # Friendly labels/icons for validators
+_STATUS_ICONS = {"pass": "✅", "warn": "⚠️"}
+_STRIP = ("validate_", "required_fields_")
+_FRIENDLY = {
+    "required_fields_passport": "All required passport fields present",
+    "required_fields_drivers_license": "All required driver’s license fields present",
+    "drivers_license_required_fields": "All required driver’s license fields present",
+    "passport_required_fields": "All required passport fields present",
+    "age": "Age is 18+ (DOB valid)",
+    "age_check": "Age is 18+ (DOB valid)",
+    "expiry": "Document not expired",
+    "expiry_date": "Document not expired",
+    "expiry_check": "Document not expired",
+    "consistency_passport_and_drivers_license": "Passport and license details are consistent",
+    "consistency": "Passport and license details are consistent",
+    "issuing_country": "Issuing country recognized",
+    "issuing_state": "Issuing state recognized",
+}
 
 def status_icon(status: str) -> str:
-    s = (status or "").lower()
-    if s == "pass":
-        return "✅"
-    if s == "warn":
-        return "⚠️"
-    return "❌"
+    return _STATUS_ICONS.get((status or "").lower(), "❌")
 
 def friendly_label(raw_name: str | None) -> str:
     if not raw_name:
         return "Check"
-    key = raw_name.replace("validate_", "").replace("required_fields_", "").lower()
-    mapping = {
-        "required_fields_passport": "All required passport fields present",
-        "required_fields_drivers_license": "All required driver’s license fields present",
-        "drivers_license_required_fields": "All required driver’s license fields present",
-        "passport_required_fields": "All required passport fields present",
-        "age": "Age is 18+ (DOB valid)",
-        "age_check": "Age is 18+ (DOB valid)",
-        "expiry": "Document not expired",
-        "expiry_date": "Document not expired",
-        "expiry_check": "Document not expired",
-        "consistency_passport_and_drivers_license": "Passport and license details are consistent",
-        "consistency": "Passport and license details are consistent",
-        "issuing_country": "Issuing country recognized",
-        "issuing_state": "Issuing state recognized",
-    }
-    return mapping.get(key, raw_name.replace("_", " ").strip().capitalize())
-
-# Optional encryption using Fernet if available; else fallback to AES-less XOR-like mask using base64
-FERNET = None
-if DB_ENC_KEY_RAW:
+    key = raw_name
+    for prefix in _STRIP:
+        key = key.replace(prefix, "")
+    return _FRIENDLY.get(key.lower(), raw_name.replace("_", " ").strip().capitalize())
+
+# Optional encryption using Fernet if available. Built lazily and cached per process, so the
+# key derivation and cipher setup run once rather than on every script rerun.
+@st.cache_resource
+def _get_fernet(raw: str):
+    if not raw:
+        return None
     try:
         from cryptography.fernet import Fernet
-        # Derive a valid Fernet key from the provided string if needed
-        try:
-            # If user provided a 32-byte urlsafe base64 key
-            Fernet(DB_ENC_KEY_RAW)
-            f_key = DB_ENC_KEY_RAW.encode()
-        except Exception:
-            # Derive from passphrase
-            digest = hashlib.sha256(DB_ENC_KEY_RAW.encode()).digest()
-            f_key = base64.urlsafe_b64encode(digest)
-        FERNET = Fernet(f_key)
     except Exception:
-        FERNET = None
+        return None
+    f_key = raw.encode()
+    try:
+        # A user-provided key must be urlsafe base64 of exactly 32 bytes
+        valid = len(base64.urlsafe_b64decode(f_key)) == 32
+    except Exception:
+        valid = False
+    if not valid:
+        # Derive from passphrase
+        f_key = base64.urlsafe_b64encode(hashlib.sha256(raw.encode()).digest())
+    return Fernet(f_key)
+
+def _seal(data: bytes) -> bytes:
+    # Encrypt at rest when LOCAL_DB_ENCRYPTION_KEY is set; the cipher is built on the first save
+    fernet = _get_fernet(DB_ENC_KEY_RAW)
+    return fernet.encrypt(data) if fernet is not None else data
+
+# JSON encoding for the local DB: orjson (returns UTF-8 bytes directly) when installed, else stdlib
+def _dumps_line(payload: dict) -> bytes:
+    if orjson is not None:
+        return _seal(orjson.dumps(payload)) + b"\n"
+    return _seal(json.dumps(payload, ensure_ascii=False).encode("utf-8")) + b"\n"
+
+def _dumps_pretty(payload: dict) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_INDENT_2)
+    return json.dumps(payload, indent=2, ensure_ascii=False).encode("utf-8")
+
+_loads = orjson.loads if orjson is not None else json.loads
+
+def _loads_line(line: bytes) -> dict | None:
+    # Plain JSON records start with "{"; anything else is a Fernet token (unreadable without the key)
+    if line.startswith(b"{"):
+        return _loads(line)
+    fernet = _get_fernet(DB_ENC_KEY_RAW)
+    if fernet is None:
+        return None
+    try:
+        return _loads(fernet.decrypt(line))
+    except Exception:
+        return None
+
+def _utc_iso() -> str:
+    # Same shape as datetime.utcnow().isoformat() + "Z", without building a datetime
+    secs, ns = divmod(time.time_ns(), 1_000_000_000)
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(secs)) + f".{ns // 1000:06d}Z"
 
-# Local DB helpers (plain JSON / JSONL; no encryption)
+# Local DB helpers (JSON / JSONL; each record Fernet-encrypted when a key is configured)
 os.makedirs(DB_CASES_DIR, exist_ok=True)
 
 def save_case_to_db(case_id: str, payload: dict) -> str:
     case_dir = os.path.join(DB_CASES_DIR, case_id)
     os.makedirs(case_dir, exist_ok=True)
     path = os.path.join(case_dir, "case.json")
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(payload, f, indent=2, ensure_ascii=False)
+    new = _dumps_pretty(payload)
+    # Write to a temp file in the same dir, then atomically swap it in (no torn case.json)
+    # (0o666 lets the kernel apply the umask, so case.json keeps the mode a plain open() gives)
+    tmp = os.path.join(case_dir, f".case.json.{os.urandom(8).hex()}.tmp")
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_seal(new))
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
     return path
 
-def append_case_jsonl(payload: dict) -> str:
+@st.cache_resource
+def _jsonl_writer():
+    # One long-lived, fully buffered append handle per process; closed at interpreter exit
     os.makedirs(DB_ROOT, exist_ok=True)
-    with open(DB_CASES_JSONL, "a", encoding="utf-8") as f:
-        f.write(json.dumps(payload, ensure_ascii=False) + "\n")
+    fh = open(DB_CASES_JSONL, "ab", buffering=64 * 1024)
+    atexit.register(fh.close)
+    return fh, threading.Lock()
+
+def append_cases_jsonl(payloads: list[dict]) -> str:
+    # All records go out as one write + one flush
+    fh, lock = _jsonl_writer()
+    with lock:
+        fh.write(b"".join(_dumps_line(p) for p in payloads))
+        fh.flush()
     return DB_CASES_JSONL
 
+def append_case_jsonl(payload: dict) -> str:
+    return append_cases_jsonl([payload])
+
+def _tail_lines(path: str, limit: int, block: int = 65536) -> list[bytes]:
+    # Read backwards from EOF until we hold more than `limit` lines; cost scales with N, not file size
+    with open(path, "rb") as f:
+        pos = f.seek(0, os.SEEK_END)
+        buf = b""
+        while pos > 0 and buf.count(b"\n") <= limit:
+            step = min(block, pos)
+            pos -= step
+            f.seek(pos)
+            buf = f.read(step) + buf
+    lines = buf.splitlines()
+    if pos > 0:
+        lines = lines[1:]  # first line may be cut mid-record
+    return [line for line in lines if line.strip()][-limit:]
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _load_recent(mtime: float, size: int, limit: int) -> list[dict]:
+    # mtime/size fingerprint the file, so any append invalidates the entry; only the newest few
+    # fingerprints are kept, so stale decrypted records don't pile up in memory
+    records = (_loads_line(line) for line in _tail_lines(DB_CASES_JSONL, limit))
+    return [r for r in records if r is not None]
+
 def load_recent_cases(limit: int = 5) -> list[dict]:
+    # Checked on every rerun so cases saved by other sessions or processes show up too;
+    # an unchanged (mtime, size) is served from the _load_recent cache without touching the file
     if not os.path.exists(DB_CASES_JSONL):
         return []
     try:
-        with open(DB_CASES_JSONL, "r", encoding="utf-8") as f:
-            lines = f.read().splitlines()
-        recent = lines[-limit:]
-        return [json.loads(line) for line in recent if line.strip()]
+        stat = os.stat(DB_CASES_JSONL)
+        recent = _load_recent(stat.st_mtime, stat.st_size, limit)
     except Exception:
         return []
+    fingerprint = (stat.st_mtime, stat.st_size, limit)
+    if st.session_state.get("recent_fp") != fingerprint:
+        # The file changed since the summary table was built; rebuild it on this rerun
+        st.session_state["recent_fp"] = fingerprint
+        st.session_state.pop("recent_df", None)
+    return recent
 
 # Seed dummy
 if "_seeded_cases" not in st.session_state:
@@ -149,21 +263,20 @@ if "_seeded_cases" not in st.session_state:
         demo1 = {
             "case_id": "01783",
             "mark_for_review": False,
-            "created_at": datetime.utcnow().isoformat() + "Z",
+            "created_at": _utc_iso(),
             "document_type": "passport",
             "passport": {"name": "JOHN DOE", "dob": "1990-01-15", "expiry_date": "2030-08-15", "id_number": "A12345678"},
         }
         demo2 = {
             "case_id": "73682",
             "mark_for_review": True,
-            "created_at": datetime.utcnow().isoformat() + "Z",
+            "created_at": _utc_iso(),
             "document_type": "drivers_license",
             "drivers_license": {"name": "JANE ROE", "dob": "1986-07-04", "expiry_date": "2025-06-01", "id_number": "D7773311", "address": "45 OAK AVE SPRINGFIELD, IL"},
         }
-        append_case_jsonl(demo1)
-        append_case_jsonl(demo2)
-        save_case_to_db("01783", demo1)
-        save_case_to_db("73682", demo2)
+        append_cases_jsonl([demo1, demo2])
+        for demo in (demo1, demo2):
+            save_case_to_db(demo["case_id"], demo)
     st.session_state["_seeded_cases"] = True
 
 # -----------------------
@@ -172,6 +285,10 @@ if "_seeded_cases" not in st.session_state:
 def _flag_submit():
     st.session_state["suppress_verify_once"] = True
 
+def _multipart(filename: str, file_bytes: bytes, mime: str | None) -> list:
+    # BytesIO over an existing bytes object shares its buffer, so each call is zero-copy
+    return [("files", (filename, io.BytesIO(file_bytes), mime or "application/octet-stream"))]
+
 # -----------------------
 # UI
 # -----------------------
@@ -199,6 +316,7 @@ doc_file = st.file_uploader(
     key="doc_file",
     accept_multiple_files=False,
 )
+file_sig = None
 if doc_file:
     if doc_file.type and doc_file.type.startswith("image/"):
         st.image(doc_file, caption=doc_file.name, width=160)
@@ -207,8 +325,18 @@ if doc_file:
 
     # Type verification with cache to avoid respinning on reruns
     try:
-        uf = doc_file; uf_bytes = uf.read(); uf.seek(0)
-        file_sig = hashlib.sha1(uf_bytes).hexdigest()
+        uf = doc_file
+        # file_id is stable per upload, so only hash when a new file arrives (not on every rerun)
+        if st.session_state.get("_last_file_id") != uf.file_id:
+            # Hash incrementally so the upload is never materialized as one bytes object
+            uf.seek(0)
+            h = hashlib.blake2b(digest_size=16)
+            for chunk in iter(lambda: uf.read(65536), b""):
+                h.update(chunk)
+            uf.seek(0)
+            st.session_state["_last_file_sig"] = h.hexdigest()
+            st.session_state["_last_file_id"] = uf.file_id
+        file_sig = st.session_state["_last_file_sig"]
         cache_key = f"{file_sig}:{selected_doc_type}"
         if "type_verify_cache" not in st.session_state:
             st.session_state["type_verify_cache"] = {}
@@ -230,10 +358,9 @@ if doc_file:
                 st.caption("Type verified ✓")
         else:
             with st.status("Checking document type…", expanded=False) as status:
-                v_mp = []
-                v_mp.append(("files", (uf.name, io.BytesIO(uf_bytes), uf.type or "application/octet-stream")))
+                v_mp = _multipart(uf.name, uf.getvalue(), uf.type)
                 v_payload = {"doc_type": selected_doc_type}
-                v_resp = requests.post(VERIFY_TYPE_URL, data=v_payload, files=v_mp, timeout=20)
+                v_resp = SESSION.post(VERIFY_TYPE_URL, data=v_payload, files=v_mp, timeout=20)
                 v_resp.raise_for_status()
                 v = v_resp.json()
                 expected = str(v.get("expected_type") or selected_doc_type).lower()
@@ -263,8 +390,7 @@ if doc_file is None:
 # Size/type validation
 if files:
     for f in files:
-        ext = f.name.split(".")[-1].lower()
-        if ext not in ALLOWED_EXT:
+        if not is_allowed(f.name):
             errors.append(f"Unsupported file type for {f.name}. Allowed: {', '.join(sorted(ALLOWED_EXT))}.")
 
 if errors:
@@ -278,14 +404,20 @@ submit = st.button("Submit for Extraction", key="submit_extract", disabled=(doc_
 if submit:
     with st.spinner("Submitting for extraction…"):
         try:
-            # Submit selected document
-            mp = []
-            uf = doc_file; uf_bytes = uf.read(); uf.seek(0)
-            mp.append(("files", (uf.name, io.BytesIO(uf_bytes), uf.type or "application/octet-stream")))
+            # Submit selected document: one /process call returns extraction and authenticity together
+            uf = doc_file
+            mp = _multipart(uf.name, uf.getvalue(), uf.type)
             payload = {"doc_type": selected_doc_type, "case_id": case_id or ""}
-            resp = requests.post(EXTRACT_URL, data=payload, files=mp, timeout=60)
+            resp = SESSION.post(PROCESS_URL, data=payload, files=mp, timeout=60)
             resp.raise_for_status()
             r = resp.json()
+            integrity = r.get("integrity") or {}
+            auth_cache = st.session_state.setdefault("authenticity_cache", {})
+            auth_cache[f"{file_sig}:{selected_doc_type}"] = {
+                "suspected": bool(integrity.get("is_suspected_fraud")),
+                "conf": integrity.get("confidence"),
+                "expl": integrity.get("explanation"),
+            }
 
             # Prepare review data
             extracted = r.get("extracted", {})
@@ -333,23 +465,10 @@ if data:
             st.text_input("DL ID number", value="" if doc_data.get("id_number") is None else str(doc_data.get("id_number", "")), key="doc_id")
             st.text_input("Address", value="" if doc_data.get("address") is None else str(doc_data.get("address", "")), key="doc_address")
 
-    # Authenticity (no caching)
-    try:
-        if doc_file:
-            with st.spinner("Running authenticity…"):
-                v_mp = []
-                uf = doc_file; uf_bytes = uf.read(); uf.seek(0)
-                v_mp.append(("files", (uf.name, io.BytesIO(uf_bytes), uf.type or "application/octet-stream")))
-                v_resp = requests.post(VERIFY_URL, files=v_mp, timeout=20, data={"doc_type": selected_doc_type})
-                v_resp.raise_for_status()
-                v = v_resp.json()
-            suspected = bool((v.get("is_suspected_fraud") if "is_suspected_fraud" in v else (v.get("integrity") or {}).get("is_suspected_fraud")))
-            conf = (v.get("confidence") if "confidence" in v else (v.get("integrity") or {}).get("confidence"))
-            expl = (v.get("explanation") if "explanation" in v else (v.get("integrity") or {}).get("explanation"))
-            if suspected:
-                st.error(f"Authenticity flag (confidence {conf}). Reason: {expl}")
-    except Exception:
-        pass
+    # Authenticity (returned with the extraction on submit)
+    auth = st.session_state.get("authenticity_cache", {}).get(f"{file_sig}:{selected_doc_type}") or {}
+    if auth.get("suspected"):
+        st.error(f"Authenticity flag (confidence {auth.get('conf')}). Reason: {auth.get('expl')}")
 
     # Relevant verification checks
     with st.expander("Verification checks"):
@@ -357,20 +476,21 @@ if data:
         if not validators:
             st.write("No checks available.")
         else:
+            # One pass: partition by status (fails, warns, passes) and count passes from the bucket size
+            fails, warns, passes = [], [], []
+            for v in validators:
+                s = (v.get("status") or "").lower()
+                (passes if s == "pass" else warns if s == "warn" else fails).append((v, s))
             # Summary
             total = len(validators)
-            num_pass = sum(1 for v in validators if (v.get("status") or "").lower() == "pass")
+            num_pass = len(passes)
             st.markdown(f"**Checks passed:** {num_pass}/{total}")
             try:
                 st.progress(num_pass / total)
             except Exception:
                 pass
             # Simplified checklist ordered by importance (fails, warns, passes)
-            def _order_key(v: dict) -> int:
-                s = (v.get("status") or "").lower()
-                return {"pass": 2, "warn": 1}.get(s, 0)
-            for v in sorted(validators, key=_order_key):
-                s = (v.get("status") or "").lower()
+            for v, s in fails + warns + passes:
                 icon = status_icon(s)
                 label = friendly_label(v.get("name"))
                 desc = v.get("message") or v.get("details") or v.get("reason") or ""
@@ -390,7 +510,7 @@ if data:
         cid = (case_id or f"{random.randint(10000, 99999)}").strip()
         payload = {
             "case_id": cid,
-            "created_at": datetime.utcnow().isoformat() + "Z",
+            "created_at": _utc_iso(),
             "mark_for_review": st.session_state.get("mark_for_review", False),
             "document_type": selected_doc_type,
             selected_doc_type: {
@@ -414,26 +534,19 @@ if data:
         if not recent:
             st.caption("No cases saved yet.")
         else:
-            # Build summary rows
-            rows = [
-                {
-                    "Case ID": row.get("case_id"),
-                    "Type": row.get("document_type"),
-                    "Review": row.get("mark_for_review"),
-                    "Created": row.get("created_at"),
-                }
-                for row in recent
-            ]
-            # Try nice table; fallback to simple list
-            try:
-                import pandas as pd  # optional
-                st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
-            except Exception:
-                for r in rows:
-                    st.write(f"• {r['Case ID']} — type={r['Type']} — review={r['Review']} — {r['Created']}")
+            # Summary table, rebuilt only when the JSONL fingerprint changes
+            df = st.session_state.get("recent_df")
+            if df is None:
+                import pandas as pd  # lazy: keeps pandas off the cold-start import path
+                df = pd.DataFrame.from_records(
+                    recent, columns=["case_id", "document_type", "mark_for_review", "created_at"]
+                ).rename(columns={"case_id": "Case ID", "document_type": "Type",
+                                  "mark_for_review": "Review", "created_at": "Created"})
+                st.session_state["recent_df"] = df
+            st.dataframe(df, hide_index=True, use_container_width=True)
 
             # Select a case to view masked details
-            case_ids = [str(r["Case ID"]) for r in rows if r.get("Case ID") is not None]
+            case_ids = [str(row["case_id"]) for row in recent if row.get("case_id") is not None]
             if case_ids:
                 default_sel = st.session_state.get("recent_case_sel")
                 try:
@@ -453,16 +566,8 @@ if data:
                             masked["id_number"] = mask_text(masked.get("id_number"))
                         if "address" in masked and isinstance(masked.get("address"), str):
                             masked["address"] = mask_text(masked.get("address"))
-                        # Render two-column pretty view
-                        left, right = st.columns(2)
-                        items = list(masked.items())
-                        mid = (len(items) + 1) // 2
-                        with left:
-                            for k, v in items[:mid]:
-                                st.markdown(f"- **{k}**: {v}")
-                        with right:
-                            for k, v in items[mid:]:
-                                st.markdown(f"- **{k}**: {v}")
+                        # One table element instead of a markdown call per field
+                        st.table({"Field": list(masked.keys()), "Value": [str(v) for v in masked.values()]})
                     else:
                         st.caption("No stored fields for this case.")
         # Add a brief retention/encryption notice